@@ -1,7 +1,12 @@
-from flask import Flask, request, jsonify, render_template, send_file, send_from_directory
+from flask import Flask, request, jsonify, render_template, send_file, send_from_directory, Response
 from flask_cors import CORS
 import os
 import json
+import time
+import orjson
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
 from werkzeug.utils import secure_filename
 from yolov8_detector import YOLOv8Detector
 from database import Database
@@ -24,92 +29,149 @@ ALLOWED_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv', 'jpg', 'jpeg', 'png'}
 detector = YOLOv8Detector()
 db = Database()
 
+# In-process TTL cache for the analytics endpoint -- the dashboard polls it
+# and most responses are identical bytes
+ANALYTICS_CACHE_KEY = 'analytics_v1'
+ANALYTICS_CACHE_TTL = 3  # seconds
+_cache = {}
+
+# When set, processed videos are handed off to nginx via X-Accel-Redirect
+# (kernel-level sendfile) instead of streaming bytes through the Python
+# worker. Requires an internal nginx location aliasing the outputs dir:
+#   location /protected/outputs/ { internal; alias /app/static/outputs/; }
+USE_X_ACCEL = os.environ.get('USE_X_ACCEL', '0') == '1'
+
+# Background processing: uploads return a job id immediately instead of
+# tying up the request worker for the length of the video. The pool is
+# deliberately small -- the detector serializes GPU access anyway.
+executor = ThreadPoolExecutor(max_workers=2)
+_jobs = {}
+_jobs_lock = threading.Lock()
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def ensure_directories():
-    """Create necessary directories if they don't exist"""
-    for folder in [app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER']]:
-        if not os.path.exists(folder):
-            os.makedirs(folder)
+# Create the working directories once at import time instead of stat'ing
+# them on every upload
+os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
 @app.route('/')
 def index():
     """Serve the main application page"""
     return render_template('index.html')
 
+def _run_job(job_id, filepath, filename):
+    """Process an uploaded file in the background and record the outcome"""
+    try:
+        # Process based on file type
+        if filename.lower().endswith(('.mp4', '.mov', '.avi', '.mkv')):
+            result = detector.process_video(filepath)
+        else:
+            result = detector.process_image(filepath)
+
+        if result.get('success'):
+            # Save to database -- keep the stored payload slim by dropping
+            # the bulky per-frame records, which only the client needs
+            db_payload = {k: v for k, v in result.items() if k != 'frame_data'}
+            video_id = db.save_video_analysis(
+                filename=filename,
+                original_path=filepath,
+                processed_path=result.get('processed_path', ''),
+                people_count=result['average_people'],
+                density_level=result['density_level'],
+                analysis_data=db_payload
+            )
+
+            # Save alert if high density
+            if result['density_level'] == 'High':
+                db.save_alert(
+                    video_id=video_id,
+                    alert_type='High Crowd Density',
+                    message=f'High density detected: {result["average_people"]} people average',
+                    severity='high'
+                )
+
+            # New analysis invalidates cached analytics
+            _cache.pop(ANALYTICS_CACHE_KEY, None)
+
+            result['video_id'] = video_id
+            with _jobs_lock:
+                _jobs[job_id] = {'status': 'finished', 'result': result}
+        else:
+            with _jobs_lock:
+                _jobs[job_id] = {'status': 'failed',
+                                 'error': result.get('error', 'Processing failed')}
+    except Exception as e:
+        with _jobs_lock:
+            _jobs[job_id] = {'status': 'failed', 'error': f'Processing error: {str(e)}'}
+
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
-    """Handle video/image upload and processing"""
+    """Handle video/image upload; processing runs in the background"""
     if 'file' not in request.files:
         return jsonify({'error': 'No file provided'}), 400
-    
+
     file = request.files['file']
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
-    
+
     if file and allowed_file(file.filename):
-        ensure_directories()
-        
         filename = secure_filename(file.filename)
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         file.save(filepath)
-        
-        try:
-            # Process based on file type
-            if filename.lower().endswith(('.mp4', '.mov', '.avi', '.mkv')):
-                result = detector.process_video(filepath)
-            else:
-                result = detector.process_image(filepath)
-            
-            if result.get('success'):
-                # Save to database
-                video_id = db.save_video_analysis(
-                    filename=filename,
-                    original_path=filepath,
-                    processed_path=result.get('processed_path', ''),
-                    people_count=result['average_people'],
-                    density_level=result['density_level'],
-                    analysis_data=result
-                )
-                
-                # Save alert if high density
-                if result['density_level'] == 'High':
-                    db.save_alert(
-                        video_id=video_id,
-                        alert_type='High Crowd Density',
-                        message=f'High density detected: {result["average_people"]} people average',
-                        severity='high'
-                    )
-                
-                result['video_id'] = video_id
-                return jsonify(result)
-            else:
-                return jsonify({'error': result.get('error', 'Processing failed')}), 500
-                
-        except Exception as e:
-            return jsonify({'error': f'Processing error: {str(e)}'}), 500
-    
+
+        job_id = uuid4().hex
+        with _jobs_lock:
+            _jobs[job_id] = {'status': 'pending'}
+        executor.submit(_run_job, job_id, filepath, filename)
+
+        return jsonify({'success': True, 'job_id': job_id,
+                        'status_url': f'/api/job/{job_id}'}), 202
+
     return jsonify({'error': 'File type not allowed'}), 400
 
+@app.route('/api/job/<job_id>')
+def get_job_status(job_id):
+    """Poll the status (and result, once finished) of a processing job"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is not None and job['status'] in ('finished', 'failed'):
+            # Terminal jobs are served exactly once and evicted; finished
+            # entries hold the full frame_data, so keeping them would grow
+            # process memory with every upload
+            del _jobs[job_id]
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] == 'finished':
+        # orjson is much faster than stdlib json for the large frame_data list
+        payload = dict(job['result'], status='finished')
+        return Response(orjson.dumps(payload), mimetype='application/json')
+    return jsonify(job)
+
 @app.route('/api/analytics')
 def get_analytics():
-    """Get recent analytics data"""
+    """Get recent analytics data (cached for a few seconds between polls)"""
+    now = time.time()
+    hit = _cache.get(ANALYTICS_CACHE_KEY)
+    if hit and now - hit[0] < ANALYTICS_CACHE_TTL:
+        return Response(hit[1], mimetype='application/json')
+
     try:
         analytics = db.get_recent_analytics(limit=10)
         alerts = db.get_alerts(limit=10)
         temples = db.get_temple_data()
-        
-        return jsonify({
+
+        resp = jsonify({
             'analytics': [
                 {
                     'id': row[0],
                     'filename': row[1],
-                    'people_count': row[4],
-                    'density_level': row[5],
-                    'created_at': row[6],
-                    'processed_path': row[3]
+                    'processed_path': row[2],
+                    'people_count': row[3],
+                    'density_level': row[4],
+                    'created_at': row[5]
                 }
                 for row in analytics
             ],
@@ -137,6 +199,8 @@ def get_analytics():
                 for row in temples
             ]
         })
+        _cache[ANALYTICS_CACHE_KEY] = (now, resp.get_data())
+        return resp
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -148,6 +212,7 @@ def update_temple_count(temple_id):
         count = data.get('count', 0)
         
         db.update_temple_count(temple_id, count)
+        _cache.pop(ANALYTICS_CACHE_KEY, None)
         return jsonify({'success': True, 'message': 'Temple count updated'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -165,6 +230,16 @@ def serve_video(filename):
 def serve_processed_video(filename):
     """Serve processed video files from outputs directory"""
     try:
+        if USE_X_ACCEL:
+            # Zero-copy: nginx streams the file (including Range requests)
+            # and the worker is free immediately
+            filename = secure_filename(filename)
+            if not os.path.exists(os.path.join('static/outputs', filename)):
+                return jsonify({'error': 'Video file not found'}), 404
+            return Response(headers={
+                'X-Accel-Redirect': f'/protected/outputs/{filename}',
+                'Content-Type': 'video/mp4'
+            })
         return send_from_directory('static/outputs', filename)
     except FileNotFoundError:
         return jsonify({'error': 'Video file not found'}), 404
@@ -230,7 +305,6 @@ def health_check():
     return jsonify({'status': 'healthy', 'service': 'Temple Crowd Management API'})
 
 if __name__ == '__main__':
-    ensure_directories()
     print("Starting Temple Crowd Management System...")
     print("Access the application at: http://localhost:5000")
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -141,14 +141,15 @@ async function analyzeFile() {
             method: 'POST',
             body: formData
         });
-        const result = await response.json();
-        if (result.success) {
-            analysisResult = result;
-            updateAnalysisUI(result);
-            showSuccess('Analysis completed successfully!');
-        } else {
-            throw new Error(result.error || 'Analysis failed');
+        const upload = await response.json();
+        if (!upload.success || !upload.job_id) {
+            throw new Error(upload.error || 'Upload failed');
         }
+        // Processing runs in the background; poll the job until it's done
+        const result = await pollJob(upload.status_url);
+        analysisResult = result;
+        updateAnalysisUI(result);
+        showSuccess('Analysis completed successfully!');
     } catch (error) {
         console.error('Analysis error:', error);
         showError('Analysis failed: ' + error.message);
@@ -159,6 +160,23 @@ async function analyzeFile() {
     }
 }
 
+async function pollJob(statusUrl, intervalMs = 2000) {
+    while (true) {
+        const response = await fetch(statusUrl);
+        if (!response.ok) {
+            throw new Error('Job not found');
+        }
+        const job = await response.json();
+        if (job.status === 'finished') {
+            return job;
+        }
+        if (job.status === 'failed') {
+            throw new Error(job.error || 'Analysis failed');
+        }
+        await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+}
+
 function updateAnalysisUI(result) {
     // Update detection stats
     document.getElementById('peopleCount').textContent = result.average_people;
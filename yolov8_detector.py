@@ -2,23 +2,200 @@ from ultralytics import YOLO
 import cv2
 import json
 import os
+import numpy as np
+import torch
+import threading
 from collections import deque
+from queue import Queue
+
+try:
+    from numba import njit
+except ImportError:  # numba is an optional accelerator
+    njit = None
+
+if njit is not None:
+    @njit(cache=True)
+    def classify_density_ids(avgs):
+        """Density id (0=Low, 1=Medium, 2=High) for every frame at once"""
+        out = np.empty(avgs.size, dtype=np.int8)
+        for i in range(avgs.size):
+            out[i] = 0 if avgs[i] < 5 else (1 if avgs[i] < 15 else 2)
+        return out
+else:
+    def classify_density_ids(avgs):
+        """Density id (0=Low, 1=Medium, 2=High) for every frame at once"""
+        return np.digitize(avgs, (5, 15)).astype(np.int8)
 
 class YOLOv8Detector:
-    def __init__(self, model_path="yolov8n.pt"):
-        self.model = YOLO(model_path)
+    BATCH_SIZE = 16  # frames per inference call
+    DENSITY_LEVELS = ("Low", "Medium", "High")  # indexed by density id
+    LABEL_CACHE_MAX = 256  # distinct pre-rendered overlay labels to keep
+    OUTPUT_DIR = "static/outputs"
+
+    def __init__(self, model_path="yolov8n.pt", frame_stride=3, precision="fp16"):
+        # TensorRT precision: "int8" (calibrated), "fp16" or "fp32"
+        self.precision = precision
+        # Run detection on every Nth frame only; consecutive frames at
+        # 25-30 fps carry almost no new information for crowd counting
+        self.frame_stride = frame_stride
+        # BGR color per density level, computed once instead of an inline
+        # ternary on every frame
+        self.density_colors = {
+            "Low": (0, 255, 0),
+            "Medium": (0, 165, 255),
+            "High": (0, 0, 255)
+        }
+        # Pre-rendered overlay text tiles keyed by (text, color, thickness)
+        self._label_cache = {}
+        # Serializes model access when several background jobs share the
+        # detector (the model holds per-call CUDA state)
+        self._infer_lock = threading.Lock()
+        # Default output dir is created once here, not per processed file
+        os.makedirs(self.OUTPUT_DIR, exist_ok=True)
+        self.use_gpu = torch.cuda.is_available()
+        # NVDEC/NVENC decode/encode needs an OpenCV build with CUDA codecs
+        self.use_cuda_codec = (self.use_gpu and hasattr(cv2, 'cudacodec')
+                               and cv2.cuda.getCudaEnabledDeviceCount() > 0)
+        if self.use_gpu:
+            self.model = self._load_tensorrt(model_path)
+            # Pinned staging buffers for batch input: H2D copies from pinned
+            # memory run as async DMA and overlap the previous batch's
+            # compute. Two buffers rotate, each guarded by a CUDA event, so
+            # refilling one can never race its still-in-flight copy.
+            self._pinned = [torch.empty((self.BATCH_SIZE, 3, 640, 640),
+                                        dtype=torch.float16, pin_memory=True)
+                            for _ in range(2)]
+            self._pinned_events = [torch.cuda.Event(), torch.cuda.Event()]
+            self._pinned_idx = 0
+        else:
+            self.model = self._load_onnx(model_path)
+        self._warmup()
         print("YOLOv8 model loaded successfully")
-    
-    def process_video(self, video_path, output_dir="static/outputs"):
+
+    def _load_tensorrt(self, model_path):
+        """
+        Export the checkpoint to a TensorRT engine once and load that.
+        Tensor cores + fused layers typically run 2-3x faster than the
+        vanilla PyTorch graph on NVIDIA GPUs.
+        """
+        if self.precision == "int8":
+            try:
+                return self._load_int8(model_path)
+            except Exception as e:
+                print(f"INT8 engine unavailable ({e}), falling back to FP16")
+
+        engine_path = os.path.splitext(model_path)[0] + ".engine"
+        try:
+            if not os.path.exists(engine_path):
+                print("Exporting TensorRT engine (one-time step, may take a few minutes)...")
+                YOLO(model_path).export(format="engine", half=self.precision != "fp32",
+                                        device=0, workspace=4,
+                                        dynamic=True, batch=self.BATCH_SIZE)
+            return YOLO(engine_path, task="detect")
+        except Exception as e:
+            print(f"TensorRT export failed ({e}), falling back to PyTorch model")
+            return YOLO(model_path)
+
+    def _load_int8(self, model_path, calib_data="coco128.yaml"):
+        """
+        Export a calibrated TensorRT INT8 engine. INT8 roughly doubles
+        throughput again over FP16 on Tensor-core GPUs, and the small mAP
+        drop is acceptable for counting person boxes. Ultralytics runs the
+        calibration pass itself from the dataset named by calib_data.
+        """
+        engine_path = os.path.splitext(model_path)[0] + ".int8.engine"
+        if not os.path.exists(engine_path):
+            print("Exporting TensorRT INT8 engine (one-time step, runs calibration)...")
+            exported = YOLO(model_path).export(format="engine", int8=True, data=calib_data,
+                                               device=0, workspace=4, batch=self.BATCH_SIZE)
+            # Keep the INT8 engine under its own name so it doesn't clash
+            # with the FP16 export
+            os.replace(exported, engine_path)
+        return YOLO(engine_path, task="detect")
+
+    def _load_onnx(self, model_path):
+        """
+        Export to ONNX once and run through ONNX Runtime when TensorRT is
+        unavailable. ORT's graph-level optimizations make it noticeably
+        faster than eager PyTorch for CPU-only deployments.
+        """
+        onnx_path = os.path.splitext(model_path)[0] + ".onnx"
+        try:
+            if not os.path.exists(onnx_path):
+                print("Exporting ONNX model (one-time step)...")
+                YOLO(model_path).export(format="onnx", dynamic=True, batch=self.BATCH_SIZE)
+            return YOLO(onnx_path, task="detect")
+        except Exception as e:
+            print(f"ONNX export failed ({e}), falling back to PyTorch model")
+            return YOLO(model_path)
+
+    def _warmup(self, runs=3):
+        """Run dummy inferences so the first real frame doesn't pay engine-setup cost"""
+        dummy = np.zeros((640, 640, 3), dtype=np.uint8)
+        for _ in range(runs):
+            self.model(dummy, classes=[0], verbose=False)
+
+    def _stage_batch(self, batch):
+        """
+        Pack resized BGR frames into the pinned staging tensor as
+        normalized RGB (zero-padded to 640x640, letterbox style) and copy
+        it to the GPU with non_blocking=True. The predictor skips its own
+        numpy preprocessing for tensor input, so no per-frame pageable
+        cudaMemcpy is paid.
+        """
+        self._pinned_idx ^= 1
+        # Wait until the copy last issued from this buffer has executed
+        # before overwriting it (a no-op for a never-recorded event)
+        self._pinned_events[self._pinned_idx].synchronize()
+        staged = self._pinned[self._pinned_idx][:len(batch)]
+        staged.zero_()  # letterbox padding
+        for i, small in enumerate(batch):
+            h, w = small.shape[:2]
+            rgb = torch.from_numpy(np.ascontiguousarray(small[:, :, ::-1]))
+            staged[i, :, :h, :w] = rgb.permute(2, 0, 1).to(torch.float16) / 255
+        gpu_batch = staged.to('cuda', non_blocking=True)
+        self._pinned_events[self._pinned_idx].record()
+        return gpu_batch
+
+    def _label_tile(self, text, color, thickness=2):
+        """
+        Pre-rendered text tile so cv2.putText runs once per distinct label
+        instead of once per frame; there are only a few hundred distinct
+        overlay strings in practice.
+        """
+        key = (text, color, thickness)
+        tile = self._label_cache.get(key)
+        if tile is None:
+            if len(self._label_cache) >= self.LABEL_CACHE_MAX:
+                self._label_cache.pop(next(iter(self._label_cache)))
+            (w, h), base = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 1, thickness)
+            tile = np.zeros((h + base, w, 3), dtype=np.uint8)
+            cv2.putText(tile, text, (0, h), cv2.FONT_HERSHEY_SIMPLEX, 1, color, thickness)
+            self._label_cache[key] = tile
+        return tile
+
+    def _blit_label(self, frame, text, color, x, y, thickness=2):
+        """Copy a cached label tile onto the frame with (x, y) as top-left"""
+        tile = self._label_tile(text, color, thickness)
+        # Clip like putText would: crop whatever falls outside the frame
+        # on any side instead of producing negative slices
+        tx, ty = max(-x, 0), max(-y, 0)
+        x, y = max(x, 0), max(y, 0)
+        h = min(tile.shape[0] - ty, frame.shape[0] - y)
+        w = min(tile.shape[1] - tx, frame.shape[1] - x)
+        if h > 0 and w > 0:
+            frame[y:y+h, x:x+w] = tile[ty:ty+h, tx:tx+w]
+
+    def process_video(self, video_path, output_dir=OUTPUT_DIR):
         """
         Process video with YOLOv8 for people detection and counting
         """
         if not os.path.exists(video_path):
             return {"error": "Video file not found"}
-        
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        
+
+        if output_dir != self.OUTPUT_DIR:
+            os.makedirs(output_dir, exist_ok=True)
+
         # Extract filename and create output path
         filename = os.path.basename(video_path)
         output_filename = f"processed_{filename}"
@@ -32,7 +209,7 @@ class YOLOv8Detector:
         # Video properties
         DENSITY_THRESHOLD = 15  # Alert threshold
         people_counts = deque(maxlen=30)  # Keep last 30 frames for average
-        frame_data = []
+        window_sum = 0  # running sum of the window, avoids re-summing per frame
         
         # Get video properties
         frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
@@ -40,80 +217,252 @@ class YOLOv8Detector:
         fps = int(cap.get(cv2.CAP_PROP_FPS))
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         
-        # Video writer setup
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (frame_width, frame_height))
+        # Hardware decode/encode via NVDEC/NVENC when available; falls back
+        # to the CPU FFmpeg paths otherwise
+        nv_reader = nv_writer = out = None
+        if self.use_cuda_codec:
+            try:
+                nv_reader = cv2.cudacodec.createVideoReader(video_path)
+                nv_writer = cv2.cudacodec.createVideoWriter(
+                    output_path, (frame_width, frame_height), cv2.cudacodec.H264, fps)
+            except cv2.error as e:
+                print(f"CUDA codec unavailable ({e}), using CPU decode/encode")
+                nv_reader = nv_writer = None
+
+        # Video writer setup (CPU path)
+        if nv_writer is None:
+            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+            out = cv2.VideoWriter(output_path, fourcc, fps, (frame_width, frame_height))
         
         frame_count = 0
         alert_frames = 0
+
+        # Resize once to the model's 640 input scale before inference
+        # instead of shipping full-res frames and letting Ultralytics
+        # letterbox them internally every call -- at 1080p+ that resize is
+        # a large share of the memory traffic
+        infer_scale = 640 / max(frame_width, frame_height)
+        if infer_scale < 1:
+            infer_size = (round(frame_width * infer_scale), round(frame_height * infer_scale))
+        else:
+            infer_scale = 1.0
+            infer_size = None
+
+        # Per-frame stats as preallocated arrays instead of one dict per
+        # frame -- a 30-minute video would otherwise hold ~54k dicts in RAM
+        capacity = total_frames if total_frames > 0 else 1024
+        counts = np.empty(capacity, dtype=np.int32)
         
         print(f"Processing video: {filename}")
         print(f"Resolution: {frame_width}x{frame_height}, FPS: {fps}, Total frames: {total_frames}")
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            # Run YOLOv8 inference
-            results = self.model(frame, classes=[0], verbose=False)  # class 0 is 'person'
-            
-            # Count people in current frame
-            current_count = len(results[0].boxes)
-            people_counts.append(current_count)
-            avg_count = round(sum(people_counts) / len(people_counts))
-            
-            # Classify density
-            density_level, color = self.classify_density(avg_count)
-            
-            # Check for high density alert
-            if avg_count > DENSITY_THRESHOLD:
-                alert_frames += 1
-            
-            # Annotate frame
-            annotated_frame = results[0].plot()
-            
-            # Add information overlay
-            cv2.putText(annotated_frame, f"People: {avg_count}", (20, 50),
-                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-            cv2.putText(annotated_frame, f"Density: {density_level}", (20, 90),
-                       cv2.FONT_HERSHEY_SIMPLEX, 1, 
-                       (0, 0, 255) if density_level == "High" else 
-                       (0, 165, 255) if density_level == "Medium" else 
-                       (0, 255, 0), 2)
-            
-            # Add alert border if high density
-            if density_level == "High":
-                cv2.rectangle(annotated_frame, (0, 0), (frame_width-1, frame_height-1), (0, 0, 255), 10)
-                cv2.putText(annotated_frame, "HIGH DENSITY ALERT!", (frame_width//2 - 150, 130),
-                           cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 3)
-            
-            # Write frame to output video
-            out.write(annotated_frame)
-            
-            # Store frame data
-            frame_data.append({
-                "frame": frame_count,
-                "people_count": current_count,
-                "avg_count": avg_count,
-                "density": density_level
-            })
-            
-            frame_count += 1
-            
-            # Progress update
-            if frame_count % 30 == 0:
-                progress = (frame_count / total_frames) * 100
-                print(f"Processing: {progress:.1f}% complete")
-        
+        # Bounded queues connecting decode -> inference -> encode so the GPU
+        # never idles waiting on video I/O (and vice-versa)
+        q_in = Queue(maxsize=32)
+        q_out = Queue(maxsize=32)
+        # First exception raised in either worker; a dead worker must not
+        # leave the pipeline blocked on a full/empty queue
+        worker_errors = []
+
+        def decode_worker():
+            """Read frames off the video and feed the inference queue"""
+            try:
+                while True:
+                    if nv_reader is not None:
+                        ret, gpu_frame = nv_reader.nextFrame()
+                        if not ret:
+                            break
+                        # NVDEC yields BGRA GpuMats; bring them to host BGR
+                        frame = cv2.cvtColor(gpu_frame.download(), cv2.COLOR_BGRA2BGR)
+                    else:
+                        ret, frame = cap.read()
+                        if not ret:
+                            break
+                    q_in.put(frame)
+            except Exception as e:
+                worker_errors.append(e)
+            finally:
+                q_in.put(None)  # sentinel: end of stream
+
+        def process_group(group, batch):
+            """
+            Run one batched inference call on the sampled frames and queue
+            every frame for encoding, reusing the latest detection for
+            frames that were skipped by the stride.
+            """
+            nonlocal last_result
+            # Run YOLOv8 inference on the whole batch at once; stream=True
+            # yields Results lazily instead of materializing the whole list,
+            # keeping peak memory flat however long the video is. On GPU the
+            # batch is staged through pinned memory for async H2D transfer.
+            # The lock keeps concurrent background jobs off the model.
+            with self._infer_lock:
+                source = self._stage_batch(batch) if batch and self.use_gpu else batch
+                results = iter(self.model.predict(source=source, stream=True, classes=[0],
+                                                  imgsz=640, verbose=False, save=False,
+                                                  save_txt=False)) if batch else iter(())  # class 0 is 'person'
+                for frame, fresh in group:
+                    if fresh:
+                        last_result = next(results)
+                    q_out.put((frame, last_result))
+
+        def write_worker():
+            """Annotate and encode frames in order as results arrive"""
+            nonlocal frame_count, alert_frames, window_sum
+            nonlocal counts
+            while True:
+                item = q_out.get()
+                if item is None:
+                    break
+                if worker_errors:
+                    continue  # keep draining so process_group never blocks
+                frame, result = item
+
+                try:
+                    # Count people in current frame and update the rolling
+                    # average incrementally (O(1) instead of summing the window)
+                    current_count = len(result.boxes)
+                    if len(people_counts) == people_counts.maxlen:
+                        window_sum -= people_counts[0]
+                    people_counts.append(current_count)
+                    window_sum += current_count
+                    avg_count = round(window_sum / len(people_counts))
+
+                    # Classify density
+                    density_level, _ = self.classify_density(avg_count)
+
+                    # Check for high density alert
+                    if avg_count > DENSITY_THRESHOLD:
+                        alert_frames += 1
+
+                    # Draw person boxes straight onto the current frame -- we
+                    # only need plain rectangles, not Ultralytics' full
+                    # Annotator with labels and scores (skipped frames still
+                    # show the latest detections). Boxes come back in the
+                    # downscaled coordinates, so scale them up to the full frame.
+                    for x1, y1, x2, y2 in (result.boxes.xyxy.cpu().numpy() / infer_scale).astype(np.int32):
+                        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                    annotated_frame = frame
+
+                    # Add information overlay (blitted from cached tiles)
+                    self._blit_label(annotated_frame, f"People: {avg_count}", (0, 255, 0), 20, 25)
+                    self._blit_label(annotated_frame, f"Density: {density_level}",
+                                     self.density_colors[density_level], 20, 65)
+
+                    # Add alert border if high density
+                    if density_level == "High":
+                        cv2.rectangle(annotated_frame, (0, 0), (frame_width-1, frame_height-1), (0, 0, 255), 10)
+                        self._blit_label(annotated_frame, "HIGH DENSITY ALERT!", (0, 0, 255),
+                                         frame_width//2 - 150, 105, thickness=3)
+
+                    # Write frame to output video
+                    if nv_writer is not None:
+                        gpu_out = cv2.cuda_GpuMat()
+                        gpu_out.upload(annotated_frame)
+                        nv_writer.write(gpu_out)
+                    else:
+                        out.write(annotated_frame)
+
+                    # Store frame stats (grow if the container under-reported
+                    # its frame count)
+                    if frame_count == counts.size:
+                        counts = np.resize(counts, counts.size * 2)
+                    counts[frame_count] = current_count
+
+                    frame_count += 1
+
+                    # Progress update
+                    if total_frames > 0 and frame_count % 30 == 0:
+                        progress = (frame_count / total_frames) * 100
+                        print(f"Processing: {progress:.1f}% complete")
+                except Exception as e:
+                    worker_errors.append(e)
+
+        decoder = threading.Thread(target=decode_worker, daemon=True)
+        writer = threading.Thread(target=write_worker, daemon=True)
+        decoder.start()
+        writer.start()
+
+        # Inference runs on the main thread: accumulate decoded frames and
+        # infer in batches to amortize kernel-launch overhead and keep the
+        # GPU busy. Only every frame_stride-th frame is actually inferred.
+        batch = []   # frames sent to the model
+        group = []   # (frame, fresh) pairs in stream order
+        last_result = None
+        frame_idx = 0
+        eof = False
+        try:
+            while True:
+                frame = q_in.get()
+                if frame is None:
+                    eof = True
+                    break
+                if worker_errors:
+                    continue  # drain the decoder; no point inferring further
+                fresh = frame_idx % self.frame_stride == 0
+                group.append((frame, fresh))
+                if fresh:
+                    small = cv2.resize(frame, infer_size, interpolation=cv2.INTER_AREA) \
+                        if infer_size else frame
+                    batch.append(small)
+                frame_idx += 1
+                if len(batch) == self.BATCH_SIZE:
+                    process_group(group, batch)
+                    group, batch = [], []
+
+            # Flush the tail batch after EOF
+            if group:
+                process_group(group, batch)
+        except Exception as e:
+            # A failing model call must not strand the decoder or writer:
+            # record the error, finish draining the decoder so it reaches
+            # its sentinel, then fall through to the shared shutdown path
+            worker_errors.append(e)
+            while not eof:
+                eof = q_in.get() is None
+
+        q_out.put(None)  # tell the writer we're done
+        decoder.join()
+        writer.join()
+
         cap.release()
-        out.release()
-        
-        # Calculate final statistics
-        final_avg = sum([f["avg_count"] for f in frame_data]) // len(frame_data) if frame_data else 0
+        if nv_writer is not None:
+            nv_writer.release()
+        else:
+            out.release()
+
+        if worker_errors:
+            return {"error": f"Processing failed: {worker_errors[0]}"}
+
+        # Rebuild the rolling 30-frame averages for the whole video in one
+        # cumulative-sum pass (same round-half-even values the live overlay
+        # showed, without storing them frame by frame)
+        n = frame_count
+        if n > 0:
+            cum = np.concatenate(([0], np.cumsum(counts[:n], dtype=np.int64)))
+            starts = np.maximum(np.arange(1, n + 1) - 30, 0)
+            avgs = np.rint((cum[1:] - cum[starts]) /
+                           (np.arange(1, n + 1) - starts)).astype(np.int32)
+        else:
+            avgs = np.empty(0, dtype=np.int32)
+
+        # Calculate final statistics (vectorized over the filled arrays)
+        final_avg = int(avgs.mean()) if n > 0 else 0
         final_density, _ = self.classify_density(final_avg)
-        
+
         alert_percentage = (alert_frames / frame_count) * 100 if frame_count > 0 else 0
+
+        # Classify every frame's density in one vectorized pass instead of
+        # branching per frame inside the hot loop
+        density_ids = classify_density_ids(avgs)
+
+        # Materialize the per-frame records only once, for the JSON response
+        frame_data = [
+            {"frame": i, "people_count": c, "avg_count": a, "density": self.DENSITY_LEVELS[d]}
+            for i, (c, a, d) in enumerate(zip(counts[:n].tolist(),
+                                              avgs.tolist(),
+                                              density_ids.tolist()))
+        ]
         
         result = {
             "success": True,
@@ -153,7 +502,8 @@ class YOLOv8Detector:
             return {"error": "Image file not found"}
         
         image = cv2.imread(image_path)
-        results = self.model(image, classes=[0], verbose=False)
+        with self._infer_lock:
+            results = self.model(image, classes=[0], verbose=False)
         
         people_count = len(results[0].boxes)
         density_level, _ = self.classify_density(people_count)